@@ -29,7 +29,7 @@ def set_extra_log_data(request_obj):
 
 
 consumer = consume.init_consumer()
-producer = produce.init_producer()
+produce.init_producer()
 
 LOG.info(f"Started listening on kafka topic - {ANNOUNCE_TOPIC}.")
 start_http_server(METRICS_PORT)
@@ -72,4 +72,4 @@ while True:
     finally:
         if not KAFKA_AUTO_COMMIT:
             consumer.commit()
-        producer.flush()
+        produce.flush_producer()
@@ -0,0 +1,37 @@
+import math
+import pytest
+
+from yuptoo.lib.json_utils import loads, dumps
+
+
+def test_loads_keeps_large_integers():
+    assert loads(b'{"a": 18446744073709551616}') == {'a': 18446744073709551616}
+    assert loads('{"a": -9223372036854775809}') == {'a': -9223372036854775809}
+
+
+def test_loads_non_finite_numbers():
+    result = loads(b'{"a": NaN, "b": Infinity, "c": -Infinity, "d": 1e400}')
+    assert math.isnan(result['a'])
+    assert result['b'] == result['d'] == math.inf
+    assert result['c'] == -math.inf
+
+
+def test_loads_lone_surrogate():
+    assert loads(b'{"a": "\\ud800"}') == {'a': '\ud800'}
+
+
+def test_loads_invalid_json():
+    with pytest.raises(ValueError):
+        loads(b'{"a": [')
+
+
+def test_loads():
+    assert loads(b'{"a": [1, "b"]}') == {'a': [1, 'b']}
+
+
+def test_dumps_large_integers():
+    assert loads(dumps({'a': 2 ** 70})) == {'a': 2 ** 70}
+
+
+def test_dumps():
+    assert loads(dumps({'a': 'é', 1: 2})) == {'a': 'é', '1': 2}
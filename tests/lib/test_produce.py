@@ -0,0 +1,75 @@
+from functools import partial
+from unittest.mock import patch, Mock
+
+from yuptoo.lib import produce
+from yuptoo.lib.config import UPLOAD_TOPIC
+
+
+def test_send_message_waits_for_in_flight_hosts():
+    request_obj = {'host_inventory_upload_count': 0}
+    callback = partial(produce.host_delivery_report, request_obj)
+    producer = Mock()
+    pending = []
+    producer.produce.side_effect = lambda topic, value, callback: pending.append(callback)
+
+    def poll(timeout):
+        while pending:
+            msg = Mock()
+            msg.topic.return_value = UPLOAD_TOPIC
+            pending.pop()(None, msg)
+    producer.poll.side_effect = poll
+
+    with patch('yuptoo.lib.produce.producer', producer):
+        with patch('yuptoo.lib.produce.hosts_in_flight', produce.BoundedSemaphore(1)):
+            produce.send_message(UPLOAD_TOPIC, {'data': 1}, callback)
+            produce.send_message(UPLOAD_TOPIC, {'data': 2}, callback)
+
+    assert producer.produce.call_count == 2
+    assert request_obj['host_inventory_upload_count'] == 2
+
+
+def test_send_message_releases_slot_on_failure():
+    producer = Mock()
+    producer.produce.side_effect = BufferError('queue full')
+    semaphore = produce.BoundedSemaphore(1)
+    with patch('yuptoo.lib.produce.producer', producer):
+        with patch('yuptoo.lib.produce.hosts_in_flight', semaphore):
+            with patch('yuptoo.lib.produce.KAFKA_PRODUCER_QUEUE_TIMEOUT', 0.1):
+                with patch('yuptoo.lib.produce.host_upload_failures') as failures:
+                    assert produce.send_message(UPLOAD_TOPIC, {'data': 1}, Mock()) is False
+    assert semaphore.acquire(blocking=False)
+    failures.inc.assert_called_once()
+
+
+def test_send_message_retries_when_queue_full():
+    producer = Mock()
+    producer.produce.side_effect = [BufferError('queue full'), None]
+    with patch('yuptoo.lib.produce.producer', producer):
+        assert produce.send_message('platform.upload.validation', {'data': 1}) is True
+    assert producer.produce.call_count == 2
+    producer.poll.assert_any_call(0.05)
+
+
+def test_send_message_default_callback_releases_slot():
+    producer = Mock()
+    semaphore = produce.BoundedSemaphore(1)
+    msg = Mock()
+    msg.topic.return_value = UPLOAD_TOPIC
+    producer.poll.side_effect = lambda timeout: producer.produce.call_args.kwargs['callback'](None, msg)
+    with patch('yuptoo.lib.produce.producer', producer):
+        with patch('yuptoo.lib.produce.hosts_in_flight', semaphore):
+            produce.send_message(UPLOAD_TOPIC, {'data': 1})
+    assert semaphore.acquire(blocking=False)
+
+
+def test_send_message_gives_up_waiting_for_slot():
+    producer = Mock()
+    semaphore = produce.BoundedSemaphore(1)
+    semaphore.acquire()
+    with patch('yuptoo.lib.produce.producer', producer):
+        with patch('yuptoo.lib.produce.hosts_in_flight', semaphore):
+            with patch('yuptoo.lib.produce.KAFKA_PRODUCER_QUEUE_TIMEOUT', 0.1):
+                with patch('yuptoo.lib.produce.host_upload_failures') as failures:
+                    assert produce.send_message(UPLOAD_TOPIC, {'data': 1}) is False
+    producer.produce.assert_not_called()
+    failures.inc.assert_called_once()
@@ -1,10 +1,14 @@
-from unittest.mock import patch
+from unittest.mock import patch, Mock, ANY
+import json
 import uuid
+import tarfile
 import pytest
 
+from io import BytesIO
 from datetime import datetime
-from yuptoo.processor.report_processor import process_report
-from yuptoo.lib.exceptions import QPCReportException
+from yuptoo.processor.report_processor import (process_report, process_report_slice, load_modifiers,
+                                               wait_for_hosts, METADATA_MISMATCH_MESSAGE)
+from yuptoo.lib.exceptions import QPCReportException, FailExtractException
 from tests.utils import create_tar_buffer
 
 
@@ -38,7 +42,7 @@ def test_process_report_without_facts():
                 {datetime.now().strftime('%Y%m%dT%H%M%SZ')}&X-Amz-Expires=86400"
     }
     request_object = {'org_id': consumed_message['org_id']}
-    buffer_content = create_tar_buffer(report_files)
+    buffer_content = BytesIO(create_tar_buffer(report_files))
     with patch('yuptoo.processor.report_processor.download_report', return_value=buffer_content):
         with patch('yuptoo.processor.report_processor.HOSTS_TRANSFORMATION_ENABLED', 0):
             with patch('yuptoo.processor.report_processor.has_canonical_facts', return_value=0):
@@ -77,7 +81,7 @@ def test_process_report():
                 {datetime.now().strftime('%Y%m%dT%H%M%SZ')}&X-Amz-Expires=86400"
     }
     request_object = {'request_id': consumed_message['request_id'], 'org_id': consumed_message['org_id']}
-    buffer_content = create_tar_buffer(report_files)
+    buffer_content = BytesIO(create_tar_buffer(report_files))
     with patch('yuptoo.processor.report_processor.upload_to_host_inventory_via_kafka', return_value=None) as mock:
         with patch('yuptoo.processor.report_processor.download_report', return_value=buffer_content):
             with patch('yuptoo.processor.report_processor.HOSTS_TRANSFORMATION_ENABLED', 0):
@@ -85,3 +89,147 @@ def test_process_report():
                     with patch('yuptoo.lib.produce.producer'):
                         process_report(consumed_message, request_object)
     mock.assert_called_once
+
+
+def test_process_report_slice_in_batches():
+    report_slice = {
+        'report_slice_id': str(uuid.uuid4()),
+        'hosts': [{'ip_addresses': [f'10.0.0.{i}']} for i in range(5)] + [{'fqdn': 'test.example.com'}]
+    }
+    request_obj = {'request_id': '123', 'candidate_hosts': 0, 'hosts_without_facts': [], 'total_host_count': 0}
+    with patch('yuptoo.processor.report_processor.upload_to_host_inventory_via_kafka') as mock:
+        with patch('yuptoo.processor.report_processor.HOSTS_TRANSFORMATION_ENABLED', 0):
+            with patch('yuptoo.processor.report_processor.HOSTS_UPLOAD_FUTURES_COUNT', 2):
+                with patch('yuptoo.processor.report_processor.send_message'):
+                    with patch('yuptoo.processor.report_processor.wait_for_hosts',
+                               wraps=wait_for_hosts) as wait_mock:
+                        process_report_slice(report_slice, request_obj, Mock())
+    assert [len(call.args[0]) for call in wait_mock.call_args_list] == [2, 2, 1]
+    assert mock.call_count == 5
+    assert request_obj['candidate_hosts'] == 5
+    assert request_obj['total_host_count'] == 6
+    assert request_obj['hosts_without_facts'] == [{report_slice['report_slice_id']: 'test.example.com'}]
+    assert 'yupana_host_id' not in report_slice['hosts'][-1]
+
+
+def test_process_report_slice_host_failure():
+    report_slice = {'report_slice_id': str(uuid.uuid4()), 'hosts': [{'ip_addresses': ['10.0.0.1']}]}
+    request_obj = {'request_id': '123', 'candidate_hosts': 0, 'hosts_without_facts': [], 'total_host_count': 0}
+    with patch('yuptoo.processor.report_processor.upload_to_host_inventory_via_kafka',
+               side_effect=RuntimeError('upload failed')):
+        with patch('yuptoo.processor.report_processor.HOSTS_TRANSFORMATION_ENABLED', 0):
+            with patch('yuptoo.processor.report_processor.send_message'):
+                with pytest.raises(RuntimeError):
+                    process_report_slice(report_slice, request_obj, Mock())
+
+
+def test_process_report_slice_drops_host_on_validation_failure():
+    report_slice = {'report_slice_id': str(uuid.uuid4()), 'hosts': [{'ip_addresses': ['10.0.0.1']}]}
+    request_obj = {'request_id': '123', 'candidate_hosts': 0, 'hosts_without_facts': [], 'total_host_count': 0}
+    with patch('yuptoo.processor.report_processor.upload_to_host_inventory_via_kafka') as mock:
+        with patch('yuptoo.processor.report_processor.HOSTS_TRANSFORMATION_ENABLED', 0):
+            with patch('yuptoo.processor.report_processor.send_message', return_value=False):
+                with patch('yuptoo.processor.report_processor.host_upload_failures') as failures:
+                    process_report_slice(report_slice, request_obj, Mock())
+    mock.assert_not_called()
+    failures.inc.assert_called_once()
+
+
+def test_load_modifiers():
+    modifiers = load_modifiers()
+    assert 'AddHostFacts' in [type(modifier).__name__ for modifier in modifiers]
+    assert load_modifiers() is modifiers
+
+
+def report_metadata(report_slices):
+    return {
+        'report_id': 1,
+        'host_inventory_api_version': '1.0.0',
+        'source': 'qpc',
+        'report_slices': report_slices
+    }
+
+
+def run_process_report(report_files, encoding='utf-8'):
+    """Run process_report on an archive of report_files and return the process_report_slice mock.
+
+    Files given as bytes are archived as-is, anything else is JSON encoded.
+    """
+    buffer_content = BytesIO()
+    with tarfile.open(fileobj=buffer_content, mode='w:gz') as tar:
+        for file_name, content in report_files.items():
+            if not isinstance(content, bytes):
+                content = json.dumps(content).encode('utf-8' if 'metadata.json' in file_name else encoding)
+            info = tarfile.TarInfo(name=file_name)
+            info.size = len(content)
+            tar.addfile(info, BytesIO(content))
+    buffer_content.seek(0)
+    with patch('yuptoo.processor.report_processor.process_report_slice') as mock:
+        with patch('yuptoo.processor.report_processor.download_report', return_value=buffer_content):
+            with patch('yuptoo.processor.report_processor.log_report_summary'):
+                with patch('yuptoo.processor.report_processor.send_message'):
+                    with patch('yuptoo.lib.produce.producer'):
+                        process_report({}, {'request_id': '123', 'org_id': '123'})
+    return mock
+
+
+def test_process_report_slices_in_directory():
+    uuid1 = str(uuid.uuid4())
+    report_json = {'report_slice_id': uuid1, 'hosts': [{'ip_addresses': ['127.0.0.1']}]}
+    mock = run_process_report({
+        'reports/metadata.json': report_metadata({uuid1: {'number_hosts': 1}}),
+        'reports/%s.json' % uuid1: report_json
+    })
+    mock.assert_called_once_with(report_json, ANY, ANY)
+
+
+def test_process_report_discards_undecodable_slice():
+    uuid1 = str(uuid.uuid4())
+    mock = run_process_report({
+        'metadata.json': report_metadata({uuid1: {'number_hosts': 1}}),
+        '%s.json' % uuid1: {'report_slice_id': uuid1, 'hosts': [{'ip_addresses': ['127.0.0.1']}]}
+    }, encoding='cp500')
+    mock.assert_not_called()
+
+
+def test_process_report_slices_in_archive_order():
+    uuid1 = str(uuid.uuid4())
+    uuid2 = str(uuid.uuid4())
+    mock = run_process_report({
+        'metadata.json': report_metadata({uuid2: {'number_hosts': 1}, uuid1: {'number_hosts': 1}}),
+        '%s.json' % uuid1: {'report_slice_id': uuid1, 'hosts': [{'ip_addresses': ['127.0.0.1']}]},
+        '%s.json' % uuid2: {'report_slice_id': uuid2, 'hosts': [{'ip_addresses': ['127.0.0.2']}]}
+    })
+    assert [call.args[0]['report_slice_id'] for call in mock.call_args_list] == [uuid1, uuid2]
+
+
+def test_process_report_discards_mismatched_slice():
+    uuid1 = str(uuid.uuid4())
+    with patch('yuptoo.processor.report_processor.LOG.warning') as warning:
+        mock = run_process_report({
+            'metadata.json': report_metadata({uuid1: {'number_hosts': 2}}),
+            '%s.json' % uuid1: {'report_slice_id': uuid1, 'hosts': [{'ip_addresses': ['127.0.0.1']}]}
+        })
+    mock.assert_not_called()
+    warning.assert_called_once_with(
+        f'Metadata for report slice {uuid1} reported 2 hosts but report contains 1 hosts. '
+        + METADATA_MISMATCH_MESSAGE
+    )
+
+
+def test_process_report_fails_on_invalid_json_slice():
+    uuid1 = str(uuid.uuid4())
+    with pytest.raises(FailExtractException, match='not valid JSON'):
+        run_process_report({
+            'metadata.json': report_metadata({uuid1: {'number_hosts': 1}}),
+            '%s.json' % uuid1: ('{"report_slice_id": "%s", "hosts": [' % uuid1).encode('utf-8')
+        })
+
+
+def test_process_report_closes_report_on_tracker_failure():
+    report_file = BytesIO(b'')
+    with patch('yuptoo.processor.report_processor.download_report', return_value=report_file):
+        with patch('yuptoo.processor.report_processor.send_message', side_effect=BufferError):
+            with pytest.raises(BufferError):
+                process_report({}, {'request_id': '123', 'org_id': '123'})
+    assert report_file.closed
@@ -1,7 +1,12 @@
 import pytest
-from unittest.mock import patch, Mock
-from yuptoo.processor.utils import has_canonical_facts, print_transformed_info, download_report
+import tarfile
+import uuid
+from io import BytesIO
+from unittest.mock import patch, MagicMock
+from yuptoo.processor.utils import (has_canonical_facts, print_transformed_info, download_report,
+                                    generate_host_ids, open_report_archive)
 from yuptoo.lib.exceptions import FailDownloadException
+from tests.utils import create_tar_buffer
 
 
 def test_print_transformed_info():
@@ -9,7 +14,8 @@ def test_print_transformed_info():
     host_id = 123
     transformed_obj = {'removed': [], 'modified': ['test'], 'missing_data': []}
     with patch('yuptoo.processor.utils.LOG.info') as mock:
-        print_transformed_info(request_obj, host_id, transformed_obj)
+        with patch('yuptoo.processor.utils.LOG.isEnabledFor', return_value=True):
+            print_transformed_info(request_obj, host_id, transformed_obj)
     log_sections = ['modified: test']
     log_message = f"Transformed details host with id {host_id}."
     log_message += '\n'.join(log_sections)
@@ -18,13 +24,43 @@ def test_print_transformed_info():
         )
 
 
+def test_print_transformed_info_info_disabled():
+    transformed_obj = {'removed': [], 'modified': ['test'], 'missing_data': []}
+    with patch('yuptoo.processor.utils.LOG.info') as mock:
+        with patch('yuptoo.processor.utils.LOG.isEnabledFor', return_value=False):
+            print_transformed_info({}, 123, transformed_obj)
+    mock.assert_not_called()
+
+
+def test_print_transformed_info_nothing_transformed():
+    transformed_obj = {'removed': [], 'modified': [], 'missing_data': []}
+    with patch('yuptoo.processor.utils.LOG.info') as mock:
+        with patch('yuptoo.processor.utils.LOG.isEnabledFor', return_value=True):
+            print_transformed_info({}, 123, transformed_obj)
+            print_transformed_info({}, 123, None)
+    mock.assert_not_called()
+
+
 def test_download_report():
     consumed_message = {'url': 'https://redhat.com'}
-    download_response = Mock()
-    download_response.content = 'test_content'
-    with patch('yuptoo.processor.utils.requests.get', return_value=download_response):
+    download_response = MagicMock()
+    download_response.__enter__.return_value = download_response
+    download_response.iter_content.return_value = [b'test_', b'content']
+    with patch('yuptoo.processor.utils.session.get', return_value=download_response) as mock:
         result = download_report(consumed_message)
-        assert result == 'test_content'
+        assert result.read() == b'test_content'
+    assert mock.call_args.kwargs['stream'] is True
+    download_response.__exit__.assert_called_once()
+
+
+def test_download_report_failure():
+    consumed_message = {'url': 'https://redhat.com'}
+    download_response = MagicMock()
+    download_response.__enter__.return_value = download_response
+    download_response.iter_content.side_effect = IOError('connection reset')
+    with patch('yuptoo.processor.utils.session.get', return_value=download_response):
+        with pytest.raises(FailDownloadException):
+            download_report(consumed_message)
 
 
 def test_download_report_without_url():
@@ -43,3 +79,46 @@ def test_has_canonical_facts_false():
     host = {}
     result = has_canonical_facts(host)
     assert result is False
+
+
+def test_open_report_archive():
+    report_file = BytesIO(create_tar_buffer({'metadata.json': {'report_id': 1}}))
+    with open_report_archive(report_file) as tar:
+        assert tar.extractfile('metadata.json').read() == b'{"report_id": 1}'
+
+
+def test_open_report_archive_without_gzip_binary():
+    report_file = BytesIO(create_tar_buffer({'metadata.json': {'report_id': 1}}))
+    with patch('yuptoo.processor.utils.GZIP_BINARY', None):
+        with open_report_archive(report_file) as tar:
+            assert tar.extractfile('metadata.json').read() == b'{"report_id": 1}'
+
+
+def test_open_report_archive_corrupted():
+    report_file = BytesIO(create_tar_buffer({'metadata.json': {'report_id': 1}})[:20])
+    with pytest.raises(tarfile.ReadError):
+        with open_report_archive(report_file):
+            pass
+
+
+def test_generate_host_ids():
+    host_ids = generate_host_ids(3)
+    assert len(set(host_ids)) == 3
+    for host_id in host_ids:
+        assert uuid.UUID(host_id).version == 4
+        assert str(uuid.UUID(host_id)) == host_id
+
+
+def test_generate_host_ids_empty():
+    assert generate_host_ids(0) == []
+
+
+def test_open_report_archive_read_error_reaps_gzip():
+    report_file = MagicMock()
+    report_file.read.side_effect = [b'\x1f\x8b', OSError('read failed')]
+    with patch('yuptoo.processor.utils.subprocess.Popen') as popen:
+        with pytest.raises(OSError):
+            with open_report_archive(report_file):
+                pass
+    popen.return_value.kill.assert_called_once()
+    popen.return_value.wait.assert_called_once()
@@ -46,8 +46,19 @@ KAFKA_AUTO_COMMIT = os.getenv("KAFKA_AUTO_COMMIT", False)
 KAFKA_CONSUMER_GROUP_ID = os.getenv("KAFKA_CONSUMER_GROUP_ID", "qpc-group")
 MAX_HOSTS_PER_REP = os.getenv('MAX_HOSTS_PER_REP', default=10000)
 HOSTS_TRANSFORMATION_ENABLED = os.getenv('HOSTS_TRANSFORMATION_ENABLED', default=True)
+HOSTS_UPLOAD_WORKERS = int(os.getenv('HOSTS_UPLOAD_WORKERS', 4))
+HOSTS_UPLOAD_FUTURES_COUNT = int(os.getenv('HOSTS_UPLOAD_FUTURES_COUNT', 100))
 KAFKA_PRODUCER_OVERRIDE_MAX_REQUEST_SIZE = os.getenv(
     'KAFKA_PRODUCER_OVERRIDE_MAX_REQUEST_SIZE', 2097152
 )
+KAFKA_PRODUCER_LINGER_MS = os.getenv('KAFKA_PRODUCER_LINGER_MS', 100)
+KAFKA_PRODUCER_BATCH_SIZE = os.getenv('KAFKA_PRODUCER_BATCH_SIZE', 65536)
+KAFKA_PRODUCER_COMPRESSION_TYPE = os.getenv('KAFKA_PRODUCER_COMPRESSION_TYPE', 'lz4')
+KAFKA_PRODUCER_FLUSH_TIMEOUT = int(os.getenv('KAFKA_PRODUCER_FLUSH_TIMEOUT', 30))
+# Seconds send_message waits for room in the producer queue before dropping a message.
+KAFKA_PRODUCER_QUEUE_TIMEOUT = int(os.getenv('KAFKA_PRODUCER_QUEUE_TIMEOUT', 30))
+# Each host also queues a validation message, so keep this well below half of
+# librdkafka's queue.buffering.max.messages (100000).
+KAFKA_PRODUCER_MAX_IN_FLIGHT_HOSTS = int(os.getenv('KAFKA_PRODUCER_MAX_IN_FLIGHT_HOSTS', 20000))
 DISCOVERY_HOST_TTL = os.getenv('DISCOVERY_HOST_TTL', '29')
 SATELLITE_HOST_TTL = os.getenv('SATELLITE_HOST_TTL', '29')
@@ -0,0 +1,40 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# orjson turns integers outside the 64-bit range into floats. Any run of 19 or
+# more digits might be such an integer, so those documents are parsed by json.
+LONG_DIGITS = re.compile(rb'[0-9]{19}')
+LONG_DIGITS_STR = re.compile(r'[0-9]{19}')
+
+if orjson:
+    def loads(data):
+        """Parse a JSON document from str or bytes."""
+        long_digits = LONG_DIGITS_STR if isinstance(data, str) else LONG_DIGITS
+        if long_digits.search(data):
+            return json.loads(data)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # json also accepts NaN, Infinity, overflowing floats and lone surrogates.
+            return json.loads(data)
+
+    def dumps(obj):
+        """Serialize obj to UTF-8 encoded JSON bytes."""
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson refuses integers outside the 64-bit range, json does not.
+            return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+else:
+    def loads(data):
+        """Parse a JSON document from str or bytes."""
+        return json.loads(data)
+
+    def dumps(obj):
+        """Serialize obj to UTF-8 encoded JSON bytes."""
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
@@ -1,46 +1,110 @@
 from confluent_kafka import Producer, KafkaException
 from yuptoo.lib.config import (INSIGHTS_KAFKA_ADDRESS, KAFKA_PRODUCER_OVERRIDE_MAX_REQUEST_SIZE,
+                               KAFKA_PRODUCER_LINGER_MS, KAFKA_PRODUCER_BATCH_SIZE,
+                               KAFKA_PRODUCER_COMPRESSION_TYPE, KAFKA_PRODUCER_FLUSH_TIMEOUT,
+                               KAFKA_PRODUCER_QUEUE_TIMEOUT, KAFKA_PRODUCER_MAX_IN_FLIGHT_HOSTS,
                                kafka_auth_config, UPLOAD_TOPIC)
-from functools import partial
 from yuptoo.lib.metrics import host_uploaded, host_upload_failures
+from yuptoo.lib.json_utils import dumps
+from threading import BoundedSemaphore, Lock
 import logging
-import json
+import time
 
 LOG = logging.getLogger(__name__)
 producer = None
+producer_lock = Lock()
+delivery_lock = Lock()
+# Host inventory messages handed to the producer but not yet acknowledged.
+hosts_in_flight = BoundedSemaphore(KAFKA_PRODUCER_MAX_IN_FLIGHT_HOSTS)
 
 
 def init_producer():
+    """Create the process wide producer, reusing it if it already exists."""
     global producer
-    connection_object = {
-        'bootstrap.servers': INSIGHTS_KAFKA_ADDRESS,
-        'message.max.bytes': KAFKA_PRODUCER_OVERRIDE_MAX_REQUEST_SIZE
-    }
-    kafka_auth_config(connection_object)
-    producer = Producer(connection_object)
+    with producer_lock:
+        if producer is None:
+            connection_object = {
+                'bootstrap.servers': INSIGHTS_KAFKA_ADDRESS,
+                'message.max.bytes': KAFKA_PRODUCER_OVERRIDE_MAX_REQUEST_SIZE,
+                'linger.ms': KAFKA_PRODUCER_LINGER_MS,
+                'batch.size': KAFKA_PRODUCER_BATCH_SIZE,
+                'compression.type': KAFKA_PRODUCER_COMPRESSION_TYPE
+            }
+            kafka_auth_config(connection_object)
+            producer = Producer(connection_object)
     return producer
 
 
-def send_message(kafka_topic, msg, request_obj=None):
+def get_producer():
+    if producer is None:
+        return init_producer()
+    return producer
+
+
+def flush_producer():
+    """Wait for queued messages to be delivered, up to KAFKA_PRODUCER_FLUSH_TIMEOUT seconds."""
+    remaining = get_producer().flush(KAFKA_PRODUCER_FLUSH_TIMEOUT)
+    if remaining:
+        LOG.error(f"{remaining} message(s) still undelivered after {KAFKA_PRODUCER_FLUSH_TIMEOUT}s flush timeout.")
+    return remaining
+
+
+def delivery_report(err, msg):
+    if msg.topic() == UPLOAD_TOPIC:
+        hosts_in_flight.release()
+    if err is not None:
+        LOG.error(f"Message delivery for topic {msg.topic()} failed: {err}")
+    else:
+        LOG.debug("Message delivered to %s [%s]", msg.topic(), msg.partition())
 
-    def delivery_report(err, msg=None, is_msg_for_hbi=False):
-        nonlocal request_obj
-        if err is not None:
-            LOG.error(f"Message delivery for topic {msg.topic()} failed: {err}")
-            if is_msg_for_hbi:
-                host_upload_failures.inc()
-        else:
-            if is_msg_for_hbi:
-                request_obj['host_inventory_upload_count'] += 1
-                host_uploaded.inc()
-            LOG.debug(f"Message delivered to {msg.topic()} [{msg.partition()}]")
 
+def host_delivery_report(request_obj, err, msg):
+    """Delivery callback for host inventory messages, bound once per report."""
+    delivery_report(err, msg)
+    if err is not None:
+        host_upload_failures.inc()
+    else:
+        # Delivery reports are served by whichever thread polls the producer.
+        with delivery_lock:
+            request_obj['host_inventory_upload_count'] += 1
+        host_uploaded.inc()
+
+
+def produce_message(producer, kafka_topic, value, callback, deadline):
+    """Produce a message, polling while the producer queue is full until the deadline."""
+    while True:
+        try:
+            producer.produce(kafka_topic, value, callback=callback)
+            return
+        except BufferError:
+            if time.monotonic() >= deadline:
+                raise
+            producer.poll(0.05)
+
+
+def send_message(kafka_topic, msg, callback=delivery_report):
+    """Queue msg on kafka_topic. Returns False if the message had to be dropped."""
+    producer = get_producer()
+    deadline = time.monotonic() + KAFKA_PRODUCER_QUEUE_TIMEOUT
     try:
-        bytes = json.dumps(msg, ensure_ascii=False).encode("utf-8")
+        bytes = dumps(msg)
         if kafka_topic == UPLOAD_TOPIC:
-            producer.produce(kafka_topic, bytes, callback=partial(delivery_report, is_msg_for_hbi=True))
+            # Only wait on the producer once too many hosts are awaiting delivery.
+            while not hosts_in_flight.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    raise BufferError(f"No delivery slot freed up within {KAFKA_PRODUCER_QUEUE_TIMEOUT}s")
+                producer.poll(0.05)
+            try:
+                produce_message(producer, kafka_topic, bytes, callback, deadline)
+            except BaseException:
+                hosts_in_flight.release()
+                raise
         else:
-            producer.produce(kafka_topic, bytes, callback=delivery_report)
-        producer.poll(1)
-    except KafkaException:
-        LOG.error(f"Failed to produce message to [{kafka_topic}] topic.")
+            produce_message(producer, kafka_topic, bytes, callback, deadline)
+        producer.poll(0)
+    except (BufferError, KafkaException) as err:
+        LOG.error(f"Failed to produce message to [{kafka_topic}] topic: {err}")
+        if kafka_topic == UPLOAD_TOPIC:
+            host_upload_failures.inc()
+        return False
+    return True
@@ -1,68 +1,108 @@
-import uuid
+import os
 import importlib
 import inspect
 import tarfile
-import json
 import logging
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from functools import lru_cache, partial
 
 
-from yuptoo.lib.config import (HOSTS_TRANSFORMATION_ENABLED,
-                               UPLOAD_TOPIC, VALIDATION_TOPIC, TRACKER_TOPIC)
+from yuptoo.lib.config import (HOSTS_TRANSFORMATION_ENABLED, HOSTS_UPLOAD_FUTURES_COUNT,
+                               HOSTS_UPLOAD_WORKERS, UPLOAD_TOPIC, VALIDATION_TOPIC, TRACKER_TOPIC)
 from yuptoo.lib.exceptions import FailExtractException, QPCReportException
 from yuptoo.validators.report_metadata_validator import validate_metadata_file
 from yuptoo.processor.utils import (has_canonical_facts, print_transformed_info,
-                                    download_report, tracker_message)
+                                    download_report, generate_host_ids, open_report_archive,
+                                    tracker_message)
 from yuptoo.lib.metrics import host_upload_failures
-from yuptoo.lib.produce import send_message
+from yuptoo.lib.produce import send_message, flush_producer, host_delivery_report
+from yuptoo.lib.json_utils import loads
+from yuptoo.lib.logger import threadctx
+from yuptoo.modifiers import get_modifiers
 
 LOG = logging.getLogger(__name__)
 
 SUCCESS_CONFIRM_STATUS = 'success'
-FAILURE_CONFIRM_STATUS = 'failure'
+METADATA_MISMATCH_MESSAGE = 'Metadata must match report slice data. Discarding the report slice as invalid.'
 
 
-def process_report_slice(report_slice, request_obj):
+def process_report_slice(report_slice, request_obj, delivery_callback):
     """
     Run all the modifiers on report slice and send modified host
     to host-inventory
     Args:
         report_slice (dict): Contains hosts array
         request_obj (dict): Object containing metadata of incoming request/report
+        delivery_callback (callable): Delivery report for the host inventory messages
     """
-    status = FAILURE_CONFIRM_STATUS
-    LOG.info(f"Processing hosts in slice with id - {report_slice.get('report_slice_id')}")
+    report_slice_id = report_slice.get('report_slice_id')
+    LOG.info(f"Processing hosts in slice with id - {report_slice_id}")
     hosts = report_slice.get('hosts', [])
     request_obj['total_host_count'] += len(hosts)
+    valid_hosts = []
     for host in hosts:
-        yupana_host_id = str(uuid.uuid4())
-        host['yupana_host_id'] = yupana_host_id
         if has_canonical_facts(host):
-            host['report_slice_id'] = report_slice.get('report_slice_id')
-            request_obj['candidate_hosts'] += 1
-            # Run modifier below
-            transformed_obj = {'removed': [], 'modified': [], 'missing_data': []}
-            if HOSTS_TRANSFORMATION_ENABLED:
-                from yuptoo.modifiers import get_modifiers
-                for modifier in get_modifiers():
-                    i = importlib.import_module('yuptoo.modifiers.' + modifier)
-                    for m in inspect.getmembers(i, inspect.isclass):
-                        if m[1].__module__ == i.__name__:
-                            m[1]().run(host, transformed_obj, request_obj=request_obj)
-
-            # We will need to contact storage broker team and confirm below behaviour.
-            status = SUCCESS_CONFIRM_STATUS
-            validation_message = {
-                'hash': request_obj['request_id'],
-                'request_id': request_obj['request_id'],
-                'validation': status
-            }
-            send_message(VALIDATION_TOPIC, validation_message)
-            print_transformed_info(request_obj, host['yupana_host_id'], transformed_obj)
-            upload_to_host_inventory_via_kafka(host, request_obj)
+            valid_hosts.append(host)
         else:
-            request_obj['hosts_without_facts'].append({report_slice.get('report_slice_id'): host['fqdn']})
+            request_obj['hosts_without_facts'].append({report_slice_id: host.get('fqdn')})
             host_upload_failures.inc()
+    request_obj['candidate_hosts'] += len(valid_hosts)
+
+    log_context = dict(vars(threadctx))
+    futures = []
+    with ThreadPoolExecutor(max_workers=HOSTS_UPLOAD_WORKERS) as executor:
+        for host, yupana_host_id in zip(valid_hosts, generate_host_ids(len(valid_hosts))):
+            host['yupana_host_id'] = yupana_host_id
+            host['report_slice_id'] = report_slice_id
+            futures.append(executor.submit(process_host, host, request_obj, delivery_callback, log_context))
+            if len(futures) >= HOSTS_UPLOAD_FUTURES_COUNT:
+                wait_for_hosts(futures)
+                futures = []
+        wait_for_hosts(futures)
+
+
+def wait_for_hosts(futures):
+    """Wait for submitted hosts and re-raise the first failure."""
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in done:
+        future.result()
+
+
+@lru_cache(maxsize=None)
+def load_modifiers():
+    """Import every modifier module once and return an instance of each modifier."""
+    modifiers = []
+    for modifier in get_modifiers():
+        i = importlib.import_module('yuptoo.modifiers.' + modifier)
+        for m in inspect.getmembers(i, inspect.isclass):
+            if m[1].__module__ == i.__name__:
+                modifiers.append(m[1]())
+    return tuple(modifiers)
+
+
+def process_host(host, request_obj, delivery_callback, log_context):
+    """Run the modifiers on a single host and send it to host-inventory."""
+    vars(threadctx).update(log_context)
+    # Run modifier below
+    transformed_obj = None
+    if HOSTS_TRANSFORMATION_ENABLED:
+        transformed_obj = {'removed': [], 'modified': [], 'missing_data': []}
+        for modifier in load_modifiers():
+            modifier.run(host, transformed_obj, request_obj=request_obj)
+
+    # We will need to contact storage broker team and confirm below behaviour.
+    validation_message = {
+        'hash': request_obj['request_id'],
+        'request_id': request_obj['request_id'],
+        'validation': SUCCESS_CONFIRM_STATUS
+    }
+    if not send_message(VALIDATION_TOPIC, validation_message):
+        # A host whose messages cannot be queued is dropped, whichever message failed.
+        LOG.error(f"Skipping host {host['yupana_host_id']}, its validation message could not be sent.")
+        host_upload_failures.inc()
+        return
+    print_transformed_info(request_obj, host['yupana_host_id'], transformed_obj)
+    upload_to_host_inventory_via_kafka(host, request_obj, delivery_callback)
 
 
 def log_report_summary(request_obj):
@@ -86,7 +126,7 @@ def log_report_summary(request_obj):
     )
 
 
-def upload_to_host_inventory_via_kafka(host, request_obj):
+def upload_to_host_inventory_via_kafka(host, request_obj, delivery_callback):
     try:
         upload_msg = {
             'operation': 'add_host',
@@ -94,9 +134,11 @@ def upload_to_host_inventory_via_kafka(host, request_obj):
             'platform_metadata': {'request_id': host['system_unique_id'],
                                   'b64_identity': request_obj['b64_identity']}
         }
-        send_message(UPLOAD_TOPIC, upload_msg, request_obj)
+        return send_message(UPLOAD_TOPIC, upload_msg, delivery_callback)
     except Exception as err:
         LOG.error(f"The following error occurred: {err}")
+        host_upload_failures.inc()
+        return False
 
 
 def process_report(consumed_message, request_obj):
@@ -107,35 +149,41 @@ def process_report(consumed_message, request_obj):
         "total_host_count": 0,
         "host_inventory_upload_count": 0
     })
+    delivery_callback = partial(host_delivery_report, request_obj)
     report_tar = download_report(consumed_message)
-    send_message(
-        TRACKER_TOPIC,
-        tracker_message(request_obj, "processing", "Report Downloaded")
-    )
     try:  # pylint: disable=too-many-nested-blocks
-        tar = tarfile.open(fileobj=BytesIO(report_tar), mode='r:*')
-        files = tar.getmembers()
-        json_files = []
-        metadata_file = None
-        for file in files:
-            # First we need to Find the metadata file
-            if '/metadata.json' in file.name or file.name == 'metadata.json':
-                metadata_file = file
-            # Next we want to add all .json files to our list
-            elif '.json' in file.name:
-                json_files.append(file)
-        if json_files and metadata_file:
-            try:
-                valid_slice_ids = validate_metadata_file(tar, metadata_file, request_obj)
-                for report_id, num_hosts in valid_slice_ids.items():
-                    for file in json_files:
-                        if report_id in file.name:
-                            matches_metadata = True
-                            mismatch_message = ''
-                            report_slice = tar.extractfile(file)
-                            LOG.info(f"Attempting to decode the file {file.name}")
+        send_message(
+            TRACKER_TOPIC,
+            tracker_message(request_obj, "processing", "Report Downloaded")
+        )
+        with open_report_archive(report_tar) as tar:
+            files = tar.getmembers()
+            json_files = []
+            metadata_file = None
+            for file in files:
+                # First we need to Find the metadata file
+                if '/metadata.json' in file.name or file.name == 'metadata.json':
+                    metadata_file = file
+                # Next we want to add all .json files with their report slice id to our list
+                elif file.name.endswith('.json'):
+                    json_files.append((os.path.basename(file.name).removesuffix('.json'), file))
+            if json_files and metadata_file:
+                try:
+                    valid_slice_ids = validate_metadata_file(tar, metadata_file, request_obj)
+                    # Read the slices in archive order so the archive is never seeked backwards.
+                    for report_id, file in json_files:
+                        num_hosts = valid_slice_ids.get(report_id)
+                        if num_hosts is None:
+                            continue
+                        mismatch_messages = []
+                        LOG.info(f"Attempting to decode the file {file.name}")
+                        report_slice_bytes = tar.extractfile(file).read()
+                        try:
+                            report_slice_json = loads(report_slice_bytes)
+                        except ValueError:
+                            # Only undecodable slices are discarded, invalid JSON fails the report.
                             try:
-                                report_slice_string = report_slice.read().decode('utf-8')
+                                report_slice_bytes.decode('utf-8')
                             except UnicodeDecodeError as error:
                                 LOG.error(
                                     f"Attempting to decode the file {file.name} "
@@ -143,39 +191,37 @@ def process_report(consumed_message, request_obj):
                                     "Discarding file."
                                 )
                                 continue
-                            LOG.info(f"Successfully decoded the file {file.name}")
-                            report_slice_json = json.loads(report_slice_string)
-                            report_slice_id = report_slice_json.get('report_slice_id', '')
-                            if report_slice_id != report_id:
-                                matches_metadata = False
-                                invalid_report_id = "Metadata & filename reported the "\
-                                    f"'report_slice_id' as {report_id} but the 'report_slice_id' "\
-                                    f"inside the JSON has a value of {report_slice_id}. "
-                                mismatch_message += invalid_report_id
-                            hosts = report_slice_json.get('hosts', {})
-
-                            if len(hosts) != num_hosts:
-                                matches_metadata = False
-                                invalid_hosts = 'Metadata for report slice'\
-                                    f" {report_slice_id} reported {num_hosts} hosts "\
-                                    f"but report contains {len(hosts)} hosts. "
-                                mismatch_message += invalid_hosts
-                            if not matches_metadata:
-                                mismatch_message += 'Metadata must match report slice data. '\
-                                    'Discarding the report slice as invalid.'
-                                LOG.warning(mismatch_message)
-                                continue
-
-                            # FIXME - performance can be improved by using Async thread
-                            process_report_slice(report_slice_json, request_obj)
-
-                from yuptoo.lib.produce import producer
-                producer.flush()
-                log_report_summary(request_obj)
-            except ValueError as error:
-                raise FailExtractException(
-                    f"Report is not valid JSON. Error: {str(error)}"
-                )
+                            raise
+                        LOG.info(f"Successfully decoded the file {file.name}")
+                        report_slice_id = report_slice_json.get('report_slice_id', '')
+                        if report_slice_id != report_id:
+                            invalid_report_id = "Metadata & filename reported the "\
+                                f"'report_slice_id' as {report_id} but the 'report_slice_id' "\
+                                f"inside the JSON has a value of {report_slice_id}. "
+                            mismatch_messages.append(invalid_report_id)
+                        hosts = report_slice_json.get('hosts', {})
+
+                        if len(hosts) != num_hosts:
+                            invalid_hosts = 'Metadata for report slice'\
+                                f" {report_slice_id} reported {num_hosts} hosts "\
+                                f"but report contains {len(hosts)} hosts. "
+                            mismatch_messages.append(invalid_hosts)
+                        if mismatch_messages:
+                            mismatch_messages.append(METADATA_MISMATCH_MESSAGE)
+                            LOG.warning(''.join(mismatch_messages))
+                            continue
+
+                        # FIXME - performance can be improved by using Async thread
+                        process_report_slice(report_slice_json, request_obj, delivery_callback)
+
+                    flush_producer()
+                    log_report_summary(request_obj)
+                except ValueError as error:
+                    raise FailExtractException(
+                        f"Report is not valid JSON. Error: {str(error)}"
+                    )
     except tarfile.ReadError as err:
         raise FailExtractException(
             f"Unexpected error reading tar file: {str(err),}")
+    finally:
+        report_tar.close()
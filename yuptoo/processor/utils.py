@@ -1,16 +1,35 @@
 import requests
+import shutil
+import subprocess
+import tarfile
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from yuptoo.lib.metrics import archive_downloaded_success, archive_failed_to_download
 from yuptoo.lib.exceptions import FailDownloadException
 import logging
 import datetime
+import os
+import tempfile
+import uuid
 
 LOG = logging.getLogger(__name__)
 
+REPORT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# (connect, read) timeouts in seconds for downloading a report.
+REPORT_DOWNLOAD_TIMEOUT = (5, 60)
+# Archives up to this size stay in memory, bigger ones spill to a temporary file.
+REPORT_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+GZIP_BINARY = shutil.which('gzip')
+GZIP_MAGIC = b'\x1f\x8b'
+# Reuse connections to the storage service across reports.
+session = requests.Session()
+CANONICAL_FACTS = frozenset(('insights_client_id', 'bios_uuid', 'ip_addresses', 'mac_addresses',
+                             'vm_uuid', 'etc_machine_id', 'subscription_manager_id'))
+
 
 def print_transformed_info(request_obj, host_id, transformed_obj):
     """Print transformed logs."""
-    if transformed_obj is None:
+    if not transformed_obj or not any(transformed_obj.values()) or not LOG.isEnabledFor(logging.INFO):
         return
 
     log_sections = []
@@ -25,8 +44,6 @@ def print_transformed_info(request_obj, host_id, transformed_obj):
 
 
 def has_canonical_facts(host):
-    CANONICAL_FACTS = ['insights_client_id', 'bios_uuid', 'ip_addresses', 'mac_addresses',
-                       'vm_uuid', 'etc_machine_id', 'subscription_manager_id']
     for fact in CANONICAL_FACTS:
         if host.get(fact):
             return True
@@ -34,10 +51,17 @@ def has_canonical_facts(host):
     return False
 
 
+def generate_host_ids(count):
+    """Generate count random UUID4 strings from a single read of the system random source."""
+    random_bytes = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=random_bytes[i:i + 16], version=4)) for i in range(0, len(random_bytes), 16)]
+
+
 def download_report(consumed_message):
     """
-    Download report. Returns the tar binary content or None if there are errors.
+    Download report. Returns a file object positioned at the start of the tar archive.
     """
+    report_file = None
     try:
         report_url = consumed_message.get('url', None)
         if not report_url:
@@ -47,18 +71,66 @@ def download_report(consumed_message):
 
         LOG.info(f"Downloading Report from {report_url}")
 
-        download_response = requests.get(report_url)
+        report_file = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_MAX_SIZE)
+        with session.get(report_url, stream=True, timeout=REPORT_DOWNLOAD_TIMEOUT) as download_response:
+            for chunk in download_response.iter_content(REPORT_DOWNLOAD_CHUNK_SIZE):
+                report_file.write(chunk)
+        report_file.seek(0)
 
         LOG.info(f"Successfully downloaded TAR from {report_url}")
         archive_downloaded_success.inc()
-        return download_response.content
+        return report_file
     except Exception as err:
+        if report_file:
+            report_file.close()
         archive_failed_to_download.inc()
         raise FailDownloadException(
             f"Unexpected error for URL {report_url}. Error: {err}"
         )
 
 
+@contextmanager
+def open_report_archive(report_file):
+    """
+    Open the downloaded report as a tarfile.
+
+    Gzip compressed reports are inflated once by the native gzip binary into an
+    uncompressed temporary file, so extracting the slices after reading the
+    metadata does not rewind and re-inflate the compressed stream. Without gzip
+    on the PATH the archive is read by tarfile directly.
+    """
+    if GZIP_BINARY and report_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+        report_file.seek(0)
+        with tempfile.TemporaryFile() as tar_file:
+            gunzip = subprocess.Popen([GZIP_BINARY, '-dc'], stdin=subprocess.PIPE,
+                                      stdout=tar_file, stderr=subprocess.PIPE)
+            try:
+                try:
+                    shutil.copyfileobj(report_file, gunzip.stdin, REPORT_DOWNLOAD_CHUNK_SIZE)
+                except BrokenPipeError:
+                    # gzip stopped reading, the reason is reported through its exit status.
+                    pass
+                finally:
+                    gunzip.stdin.close()
+                error = gunzip.stderr.read().decode('utf-8', 'replace').strip()
+            except BaseException:
+                gunzip.kill()
+                raise
+            finally:
+                gunzip.stderr.close()
+                returncode = gunzip.wait()
+            # Exit status 2 only signals a warning such as trailing garbage.
+            if returncode not in (0, 2):
+                raise tarfile.ReadError(f"gzip failed to decompress the report: {error}")
+            tar_file.seek(0)
+            with tarfile.open(fileobj=tar_file, mode='r:') as tar:
+                yield tar
+    else:
+        report_file.seek(0)
+        with tarfile.open(fileobj=report_file, mode='r:*') as tar:
+            yield tar
+
+
 def tracker_message(request_obj, status, status_msg):
 
     return {